@@ -2,24 +2,20 @@
 
 import streamlit as st
 import pandas as pd
-import av
-import cv2
-import numpy as np
-import altair as alt
-import base64
-import time
-from pyzbar import pyzbar
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime
+from collections import OrderedDict
+from functools import partial
+from sqlalchemy import create_engine, event, select, insert, update, func, text, Index, CheckConstraint, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship, joinedload
 from datetime import datetime
-from streamlit_webrtc import webrtc_streamer, VideoProcessorBase
 
 # Database setup
 Base = declarative_base()
-engine = create_engine('sqlite:///inventory.db')
-Session = sessionmaker(bind=engine)
-session = Session()
+
+# SQLite's CURRENT_TIMESTAMP is UTC; the app stores local time, so server defaults match that.
+# The Python defaults stay because tables created before server_default existed have no DB default.
+LOCAL_NOW = text("(datetime('now', 'localtime'))")
 
 # Database models
 class Department(Base):
@@ -30,62 +26,151 @@ class Department(Base):
 
 class Item(Base):
     __tablename__ = 'items'
+    __table_args__ = (CheckConstraint('quantity >= 0', name='ck_items_quantity_nonnegative'),)
     id = Column(Integer, primary_key=True)
     name = Column(String(100))
-    barcode = Column(String(50), unique=True)
+    barcode = Column(String(50), unique=True, index=True)
     quantity = Column(Integer)
     low_stock_threshold = Column(Integer)
     department_id = Column(Integer, ForeignKey('departments.id'))
-    last_updated = Column(DateTime, default=datetime.now)
+    last_updated = Column(DateTime, default=datetime.now, server_default=LOCAL_NOW)
     department = relationship("Department", back_populates="items")
 
 class StockHistory(Base):
     __tablename__ = 'stock_history'
+    # Serves the per-item trend query (filter on item_id, order by timestamp) as an index seek
+    __table_args__ = (Index('ix_hist_item_ts', 'item_id', 'timestamp'),)
     id = Column(Integer, primary_key=True)
     item_id = Column(Integer, ForeignKey('items.id'))
     change = Column(Integer)
-    timestamp = Column(DateTime, default=datetime.now)
+    timestamp = Column(DateTime, default=datetime.now, server_default=LOCAL_NOW)
     note = Column(String(200))
 
-Base.metadata.create_all(engine)
+# WAL lets scan lookups read while IN/OUT commits are writing; NORMAL sync is safe under WAL
+def _sqlite_pragmas(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    # 256 MB memory-mapped reads and a 64 MB page cache (negative = KiB) per connection
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.execute("PRAGMA cache_size=-65536")
+    cur.close()
+
+# Streamlit re-executes this script on every rerun; build the engine and tables once per process
+@st.cache_resource
+def _init_db():
+    engine = create_engine(
+        'sqlite:///inventory.db',
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    event.listen(engine, "connect", _sqlite_pragmas)
+    Base.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add new indexes to older databases explicitly
+    for index in StockHistory.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    return engine
 
-# Barcode scanner processor
-class BarcodeProcessor(VideoProcessorBase):
-    def __init__(self):
-        self.last_detected_barcode = None
+engine = _init_db()
 
-    def recv(self, frame):
-        img = frame.to_ndarray(format="bgr24")
-        detected_barcodes = pyzbar.decode(img)
+# Thread-local sessions; each handler opens one and main() removes it at the end of the rerun
+SessionFactory = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 
-        if detected_barcodes:
-            self.last_detected_barcode = detected_barcodes[0].data.decode("utf-8")
-            for barcode in detected_barcodes:
-                (x, y, w, h) = barcode.rect
-                cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        else:
-            self.last_detected_barcode = None
+# ZBar only runs the readers for these symbologies (ZBarSymbol names); narrowed further from the sidebar
+SUPPORTED_SYMBOLS = ["EAN13", "EAN8", "UPCA", "UPCE", "CODE128", "CODE39", "I25", "QRCODE"]
+ENABLED_SYMBOLS = ["EAN13", "CODE128", "QRCODE"]
 
-        return av.VideoFrame.from_ndarray(img, format="bgr24")
+# Camera capture settings; decode cost grows with pixel count, so keep them modest
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+CAMERA_FPS = 15
+RTC_CONFIGURATION = {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
 
 # Helper function to scan barcode
 def scan_barcode(label="Scan Barcode"):
+    from streamlit_webrtc import webrtc_streamer
+    from barcode_scanner import BarcodeProcessor
+
     st.info(label)
+    # An empty selection means "every type" (see BarcodeProcessor.set_symbols)
+    symbols = st.session_state.get("barcode_symbols", ENABLED_SYMBOLS)
     ctx = webrtc_streamer(
         key=label,
-        video_processor_factory=BarcodeProcessor,
-        media_stream_constraints={"video": True, "audio": False},
+        video_processor_factory=partial(BarcodeProcessor, symbols),
+        media_stream_constraints={
+            "video": {"width": CAMERA_WIDTH, "height": CAMERA_HEIGHT, "frameRate": {"ideal": CAMERA_FPS}},
+            "audio": False,
+        },
+        rtc_configuration=RTC_CONFIGURATION,
+        video_html_attrs={"autoPlay": True, "controls": False, "muted": True},
     )
 
     if ctx.video_processor:
+        ctx.video_processor.set_symbols(symbols)
         if ctx.video_processor.last_detected_barcode:
             barcode = ctx.video_processor.last_detected_barcode
+            # The message is part of this rerun's output, so no pause is needed for it to be seen
             st.success(f"Detected Barcode: {barcode}")
-            time.sleep(1)
             ctx.stop()
             return barcode
     return None
 
+# Cached department list as (id, name) tuples, shared by all sessions; anything that writes
+# departments must call _departments_cached.clear() (nothing does yet, so the TTL bounds staleness)
+@st.cache_data(ttl=60)
+def _departments_cached():
+    with SessionFactory() as session:
+        return [tuple(row) for row in session.query(Department.id, Department.name).order_by(Department.name)]
+
+# Cheap change token for the inventory cache: any stock update bumps last_updated, any insert bumps the count
+def _inventory_version():
+    with SessionFactory() as session:
+        return tuple(session.query(func.max(Item.last_updated), func.count(Item.id)).one())
+
+# Cached inventory table keyed on _inventory_version(); also cleared after every item/stock write
+@st.cache_data(ttl=60)
+def _inventory_df_cached(version):
+    return _read_inventory(_inventory_select())
+
+# Low-stock rows filtered in SQL, so the alert only transfers the (usually few) matching items
+@st.cache_data(ttl=60)
+def _low_stock_df_cached(version):
+    return _read_inventory(_inventory_select().where(Item.quantity < Item.low_stock_threshold))
+
+def _inventory_select():
+    return select(
+        Item.name.label("Item Name"),
+        Department.name.label("Department"),
+        Item.quantity.label("Quantity"),
+        Item.low_stock_threshold.label("Low Stock Threshold"),
+        Item.last_updated.label("Last Updated"),
+    ).join(Department)
+
+def _read_inventory(query):
+    # pandas builds the columns straight from the cursor; no ORM objects or per-row dicts
+    df = pd.read_sql(query, engine)
+    # Department repeats on every row; categorical keeps the Arrow payload small
+    df["Department"] = df["Department"].astype("category")
+    return df
+
+# Barcode -> (id, name) for recently scanned items, per browser session; only hits are kept,
+# so a newly added item is never hidden behind a cached miss
+ITEM_LOOKUP_CACHE_SIZE = 32
+
+def _lookup_item(session, barcode):
+    cache = st.session_state.setdefault("item_lookup", OrderedDict())
+    if barcode in cache:
+        cache.move_to_end(barcode)
+        return cache[barcode]
+
+    item = session.query(Item.id, Item.name).filter_by(barcode=barcode).first()
+    if item:
+        cache[barcode] = item
+        if len(cache) > ITEM_LOOKUP_CACHE_SIZE:
+            cache.popitem(last=False)
+    return item
+
 # Home page
 def home():
     st.title("Inventory Management System")
@@ -122,35 +207,61 @@ def handle_in_out(is_in=True):
     st.header(f"{action} Inventory")
     barcode = scan_barcode(f"{action} Inventory - Scan Barcode")
     if barcode:
-        item = session.query(Item).filter_by(barcode=barcode).first()
-        if item:
-            qty = st.number_input("Enter Quantity", min_value=1, step=1)
-            if st.button("Submit"):
-                change = qty if is_in else -qty
-                item.quantity += change
-                item.last_updated = datetime.now()
-
-                # Save history
-                history = StockHistory(item_id=item.id, change=change, note="IN" if is_in else "OUT")
-                session.add(history)
-
-                session.commit()
-                st.success(f"Inventory updated for '{item.name}'!")
-        else:
-            st.error("Item not found! Please add the item first.")
+        with SessionFactory() as session:
+            # Only the id and name are needed; the quantity is changed in SQL below
+            item = _lookup_item(session, barcode)
+            if item:
+                qty = st.number_input("Enter Quantity", min_value=1, step=1)
+                if st.button("Submit"):
+                    change = qty if is_in else -qty
+                    now = datetime.now()
+                    # Atomic read-modify-write in the database, no lost updates between concurrent scans.
+                    # The quantity guard also covers databases created before the CHECK constraint existed.
+                    result = session.execute(
+                        update(Item)
+                        .where(Item.id == item.id, Item.quantity + change >= 0)
+                        .values(quantity=Item.quantity + change, last_updated=now)
+                    )
+                    if result.rowcount == 0:
+                        session.rollback()
+                        if is_in:
+                            # An IN can only miss if the row is gone or its quantity is NULL;
+                            # forget the cached lookup so the next scan reads the item again
+                            st.session_state.get("item_lookup", {}).pop(barcode, None)
+                            st.error(f"'{item.name}' no longer exists or has no quantity set!")
+                        else:
+                            st.error(f"Not enough stock of '{item.name}' to remove {qty}!")
+                        return
+
+                    # Save history in the same transaction as the quantity change
+                    session.execute(
+                        insert(StockHistory)
+                        .values(item_id=item.id, change=change, timestamp=now, note="IN" if is_in else "OUT")
+                    )
+                    session.commit()
+                    _inventory_df_cached.clear()
+                    _low_stock_df_cached.clear()
+                    st.success(f"Inventory updated for '{item.name}'!")
+            else:
+                st.error("Item not found! Please add the item first.")
 
 # Add new item (scan first)
 def add_new_item():
     st.header("Add New Item to Inventory")
     barcode = scan_barcode("Add New Item - Scan Barcode")
     if barcode:
-        departments = session.query(Department).all()
+        departments = _departments_cached()
         if not departments:
             st.warning("Please add at least one department first!")
             return
         
-        with st.form("add_item_form"):
-            dept = st.selectbox("Select Department", departments, format_func=lambda x: x.name)
+        with SessionFactory() as session:
+            if session.query(Item.id).filter_by(barcode=barcode).scalar():
+                st.error("An item with this barcode already exists!")
+                return
+
+        with SessionFactory() as session, st.form("add_item_form"):
+            dept_id, _ = st.selectbox("Select Department", departments, format_func=lambda d: d[1])
             item_name = st.text_input("Item Name")
             quantity = st.number_input("Initial Quantity", min_value=0)
             low_stock = st.number_input("Low Stock Threshold", min_value=1)
@@ -162,62 +273,81 @@ def add_new_item():
                     barcode=barcode,
                     quantity=quantity,
                     low_stock_threshold=low_stock,
-                    department_id=dept.id
+                    department_id=dept_id
                 )
                 session.add(new_item)
-                session.commit()
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Another session added the same barcode since the check above
+                    session.rollback()
+                    st.error("An item with this barcode already exists!")
+                    return
+                _inventory_df_cached.clear()
+                _low_stock_df_cached.clear()
                 st.success(f"Item '{item_name}' added successfully!")
 
 # Retrieve item info
 def retrieve_item():
+    import altair as alt
+
     st.header("Retrieve Item Information")
     barcode = scan_barcode("Retrieve Item Info - Scan Barcode")
     if barcode:
-        item = session.query(Item).filter_by(barcode=barcode).first()
-        if item:
-            st.subheader(f"Item: {item.name}")
-            st.write(f"**Department:** {item.department.name}")
-            st.write(f"**Current Quantity:** {item.quantity}")
-            st.write(f"**Low Stock Threshold:** {item.low_stock_threshold}")
-            st.write(f"**Last Updated:** {item.last_updated.strftime('%Y-%m-%d %H:%M')}")
-
-            # Show quantity trend
-            history = session.query(StockHistory).filter_by(item_id=item.id).order_by(StockHistory.timestamp).all()
-            if history:
-                trend_data = pd.DataFrame({
-                    "Timestamp": [h.timestamp for h in history],
-                    "Quantity Change": [h.change for h in history]
-                })
-                trend_data["Running Quantity"] = trend_data["Quantity Change"].cumsum() + item.quantity - trend_data["Quantity Change"].sum()
-
-                chart = alt.Chart(trend_data).mark_line(point=True).encode(
-                    x="Timestamp:T",
-                    y="Running Quantity:Q"
-                ).properties(
-                    title="Quantity Trend Over Time"
-                )
-                st.altair_chart(chart, use_container_width=True)
-        else:
-            st.error("Item not found!")
+        with SessionFactory() as session:
+            item = session.query(Item).options(joinedload(Item.department).load_only(Department.name)).filter_by(barcode=barcode).first()
+            if item:
+                st.subheader(f"Item: {item.name}")
+                st.write(f"**Department:** {item.department.name}")
+                st.write(f"**Current Quantity:** {item.quantity}")
+                st.write(f"**Low Stock Threshold:** {item.low_stock_threshold}")
+                st.write(f"**Last Updated:** {item.last_updated.strftime('%Y-%m-%d %H:%M')}")
+
+                # Show quantity trend
+                history = session.query(StockHistory.timestamp, StockHistory.change).filter_by(item_id=item.id).order_by(StockHistory.timestamp).all()
+                if history:
+                    trend_data = pd.DataFrame(history, columns=["Timestamp", "Quantity Change"])
+                    # Quantity after each change = current quantity minus every later change
+                    changes = trend_data["Quantity Change"]
+                    trend_data["Running Quantity"] = item.quantity - changes[::-1].cumsum()[::-1] + changes
+
+                    chart = alt.Chart(trend_data).mark_line(point=True).encode(
+                        x="Timestamp:T",
+                        y="Running Quantity:Q"
+                    ).properties(
+                        title="Quantity Trend Over Time"
+                    )
+                    st.altair_chart(chart, use_container_width=True)
+            else:
+                st.error("Item not found!")
+
+CHART_TOP_N = 30
 
 # View analytics and trends
 def view_analytics():
+    import altair as alt
+
     st.header("Inventory Analytics and Trends")
-    items = session.query(Item).all()
+    version = _inventory_version()
+    df = _inventory_df_cached(version)
     
-    if items:
-        df = pd.DataFrame([{
-            "Item Name": item.name,
-            "Department": item.department.name,
-            "Quantity": item.quantity,
-            "Low Stock Threshold": item.low_stock_threshold,
-            "Last Updated": item.last_updated
-        } for item in items])
-
+    if not df.empty:
         st.dataframe(df)
 
-        # Inventory levels bar chart
-        bar_chart = alt.Chart(df).mark_bar().encode(
+        # Inventory levels bar chart: top items by quantity, the tail folded into "Other"
+        # Rows without a quantity (e.g. raw SQL inserts) have no bar, as before; int32 can't hold NULL
+        plot_df = df[["Item Name", "Department", "Quantity"]].dropna(subset=["Quantity"])
+        if len(plot_df) > CHART_TOP_N:
+            top = plot_df.nlargest(CHART_TOP_N, "Quantity")
+            rest = pd.DataFrame([{
+                "Item Name": "Other",
+                "Department": "—",
+                "Quantity": plot_df["Quantity"].drop(top.index).sum()
+            }])
+            plot_df = pd.concat([top, rest], ignore_index=True)
+        plot_df = plot_df.astype({"Quantity": "int32"})
+
+        bar_chart = alt.Chart(plot_df).mark_bar().encode(
             x="Item Name",
             y="Quantity",
             color="Department"
@@ -230,7 +360,7 @@ def view_analytics():
 
         # Low stock items
         st.subheader("Low Stock Items")
-        low_stock_df = df[df["Quantity"] < df["Low Stock Threshold"]]
+        low_stock_df = _low_stock_df_cached(version)
         if not low_stock_df.empty:
             st.dataframe(low_stock_df)
         else:
@@ -242,13 +372,24 @@ def view_analytics():
 def main():
     menu = ["Home", "Manage Departments", "View Inventory"]
     choice = st.sidebar.selectbox("Menu", menu)
+    st.sidebar.multiselect(
+        "Barcode Types",
+        SUPPORTED_SYMBOLS,
+        default=ENABLED_SYMBOLS,
+        key="barcode_symbols",
+        help="Leave empty to scan for every supported type.",
+    )
 
-    if choice == "Home":
-        home()
-    elif choice == "Manage Departments":
-        manage_departments()
-    elif choice == "View Inventory":
-        view_inventory()
+    # Streamlit ends reruns by raising (st.stop, st.rerun), so release the thread's session in finally
+    try:
+        if choice == "Home":
+            home()
+        elif choice == "Manage Departments":
+            manage_departments()
+        elif choice == "View Inventory":
+            view_inventory()
+    finally:
+        SessionFactory.remove()
 
 if __name__ == "__main__":
     main()
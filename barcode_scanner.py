@@ -0,0 +1,262 @@
+# barcode_scanner.py
+# WebRTC barcode processor; imported lazily by Inventory_app.scan_barcode so pages
+# that never scan don't pay for av/cv2/pyzbar/streamlit_webrtc
+
+import queue
+import threading
+from ctypes import c_void_p
+
+import av
+import cv2
+import numpy as np
+from pyzbar.pyzbar import ZBarSymbol, _decode_symbols, _symbols_for_image
+from pyzbar.pyzbar_error import PyZbarError
+from pyzbar.wrapper import (
+    ZBarConfig, zbar_image_create, zbar_image_destroy, zbar_image_scanner_create,
+    zbar_image_scanner_destroy, zbar_image_scanner_set_config, zbar_image_set_data,
+    zbar_image_set_format, zbar_image_set_size, zbar_scan_image,
+)
+from streamlit_webrtc import VideoProcessorBase
+
+# Frames are shrunk to at most this width before decoding; ZBar cost is roughly linear in pixels
+DECODE_MAX_WIDTH = 320
+
+# 'Y800' fourcc: 8-bit grayscale, the only format ZBar scans natively
+_Y800 = 0x30303859
+
+class ZBarDecoder:
+    # pyzbar.decode creates and configures a fresh ZBar scanner and copies the image to bytes on
+    # every call; this keeps one configured scanner and hands ZBar the ndarray buffer directly.
+    # Not thread-safe: create and use it on the decode worker thread only.
+    def __init__(self):
+        self.scanner = None
+        self.symbols = None
+        self.set_symbols(None)
+
+    def set_symbols(self, symbols):
+        # A fresh scanner restores ZBar's default symbology set before narrowing it
+        self.close()
+        self.scanner = zbar_image_scanner_create()
+        if symbols:
+            zbar_image_scanner_set_config(self.scanner, ZBarSymbol.NONE, ZBarConfig.CFG_ENABLE, 0)
+            for symbol in symbols:
+                zbar_image_scanner_set_config(self.scanner, symbol, ZBarConfig.CFG_ENABLE, 1)
+        self.symbols = symbols
+
+    def decode(self, gray):
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        height, width = gray.shape
+        image = zbar_image_create()
+        try:
+            zbar_image_set_format(image, _Y800)
+            zbar_image_set_size(image, width, height)
+            # ZBar reads the buffer in place; `gray` stays referenced until the image is destroyed
+            zbar_image_set_data(image, c_void_p(gray.ctypes.data), gray.nbytes, None)
+            if zbar_scan_image(self.scanner, image) < 0:
+                raise PyZbarError("Unsupported image format")
+            return list(_decode_symbols(_symbols_for_image(image)))
+        finally:
+            zbar_image_destroy(image)
+
+    def close(self):
+        if self.scanner is not None:
+            zbar_image_scanner_destroy(self.scanner)
+            self.scanner = None
+
+# Candidate barcode regions, cheapest first stage before decoding
+ROI_MIN_AREA = 400
+ROI_MAX_CANDIDATES = 3
+ROI_PAD = 8
+ROI_DECODE_HEIGHT = 100
+
+def _find_barcode_rois(gray):
+    # 1D barcodes are dense vertical edges: strong x-gradient, weak y-gradient
+    grad_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=-1)
+    grad_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=-1)
+    grad = cv2.blur(cv2.convertScaleAbs(cv2.subtract(grad_x, grad_y)), (9, 9))
+    _, mask = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7)))
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted((c for c in contours if cv2.contourArea(c) >= ROI_MIN_AREA), key=cv2.contourArea, reverse=True)
+    return [cv2.boundingRect(c) for c in contours[:ROI_MAX_CANDIDATES]]
+
+# OpenCV's 1D detector reports types as ints (contrib <= 4.7) or strings like "EAN_13" (>= 4.8);
+# map them onto ZBarSymbol names so the sidebar selection filters both decoders the same way
+_CV_TYPE_NAMES = {1: "EAN8", 2: "EAN13", 3: "UPCA", 4: "UPCE"}
+
+def _cv_type_name(cv_type):
+    if isinstance(cv_type, str):
+        return cv_type.replace("_", "").upper()
+    return _CV_TYPE_NAMES.get(int(cv_type))
+
+def _decode_patch(gray, roi, decoder):
+    x, y, w, h = roi
+    x0, y0 = max(x - ROI_PAD, 0), max(y - ROI_PAD, 0)
+    patch = gray[y0:y + h + ROI_PAD, x0:x + w + ROI_PAD]
+    if patch.size == 0:
+        return None
+
+    # Upscale short patches to ROI_DECODE_HEIGHT so thin bars stay readable; never shrink a patch
+    scale = max(1.0, ROI_DECODE_HEIGHT / patch.shape[0])
+    if scale > 1.0:
+        patch = cv2.resize(patch, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    for candidate in (patch, cv2.adaptiveThreshold(patch, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 15, 2)):
+        detected = decoder.decode(candidate)
+        if detected:
+            return detected[0].data.decode("utf-8")
+    return None
+
+def _shrink(gray):
+    # Decode on a grayscale copy no wider than DECODE_MAX_WIDTH; returns (image, scale)
+    scale = min(1.0, DECODE_MAX_WIDTH / gray.shape[1])
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+# Barcode scanner processor
+class BarcodeProcessor(VideoProcessorBase):
+    # Only every FRAME_SKIP-th frame is decoded
+    FRAME_SKIP = 3
+    # Keep reporting the last barcode until this many decodes in a row find nothing
+    MISS_RESET = 5
+    # When ROI patches were found but none decoded, scan the whole frame only on every Nth such decode
+    FULL_FRAME_EVERY = 3
+
+    def __init__(self, symbols=None):
+        self.last_detected_barcode = None
+        # Overlay corners ((x1, y1), (x2, y2)) in full-frame pixels, published by the worker
+        self.last_boxes = []
+        self.count = 0
+        self.misses = 0
+        self.roi_misses = 0
+        self.set_symbols(symbols)
+        # cv2.barcode is missing from OpenCV builds without the barcode module
+        self.cv_detector = cv2.barcode.BarcodeDetector() if hasattr(cv2, "barcode") else None
+        # Region of the last successful patch decode, tried first on the next frame
+        self.last_roi = None
+
+        # Decoding runs off the WebRTC thread; the slot only ever holds the newest frame
+        self.frame_slot = queue.Queue(maxsize=1)
+        self.result_lock = threading.Lock()
+        self.stopped = threading.Event()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def set_symbols(self, names):
+        # None/empty means every symbology, for both OpenCV and ZBar
+        self.symbols = [ZBarSymbol[name] for name in names] if names else None
+
+    def _worker(self):
+        self.zbar = ZBarDecoder()
+        try:
+            while not self.stopped.is_set():
+                job = self.frame_slot.get()
+                if job is None:
+                    return
+                self._process(*job)
+        finally:
+            self.zbar.close()
+
+    def _process(self, small, scale):
+        # set_symbols runs on the Streamlit thread; apply it to the scanner here, on its own thread
+        if self.zbar.symbols != self.symbols:
+            self.zbar.set_symbols(self.symbols)
+
+        detected_barcodes = self._decode(small)
+        # Scale rects back up to the full-size frame and precompute the corners to draw
+        boxes = []
+        for _, (x, y, w, h) in detected_barcodes:
+            x, y, w, h = (int(v / scale) for v in (x, y, w, h))
+            boxes.append(((x, y), (x + w, y + h)))
+
+        with self.result_lock:
+            if detected_barcodes:
+                self.last_detected_barcode = detected_barcodes[0][0]
+                self.misses = 0
+            else:
+                self.misses += 1
+                if self.misses >= self.MISS_RESET:
+                    self.last_detected_barcode = None
+            self.last_boxes = boxes
+
+    def _decode(self, gray):
+        # Returns [(data, (x, y, w, h)), ...]; OpenCV's detector first, ZBar as fallback
+        # OpenCV only finds 1D codes; skip it entirely when the selection is QR-only
+        wanted = None if self.symbols is None else {symbol.name for symbol in self.symbols}
+        if self.cv_detector is not None and (wanted is None or wanted - {"QRCODE"}):
+            # OpenCV >= 4.8 renamed the typed variant; older contrib builds return the same tuple
+            detect = getattr(self.cv_detector, "detectAndDecodeWithType", self.cv_detector.detectAndDecode)
+            ok, infos, types, points = detect(gray)
+            if ok and points is not None:
+                found = [
+                    (info, cv2.boundingRect(pts.astype(np.int32)))
+                    for info, cv_type, pts in zip(infos, types, points)
+                    if info and (wanted is None or _cv_type_name(cv_type) in wanted)
+                ]
+                if found:
+                    return found
+
+        # Decode small normalized patches around likely barcodes, starting with the last hit
+        candidates = ([self.last_roi] if self.last_roi else []) + _find_barcode_rois(gray)
+        for roi in candidates:
+            data = _decode_patch(gray, roi, self.zbar)
+            if data:
+                self.last_roi = roi
+                return [(data, roi)]
+        self.last_roi = None
+
+        # No candidates: the full frame is the only thing left to try. Otherwise fall back to it on
+        # every FULL_FRAME_EVERY-th miss; the ROI finder also fires on noise, so misses are common
+        if candidates:
+            self.roi_misses += 1
+            if self.roi_misses % self.FULL_FRAME_EVERY != 0:
+                return []
+
+        return [(barcode.data.decode("utf-8"), tuple(barcode.rect)) for barcode in self.zbar.decode(gray)]
+
+    def _submit(self, job):
+        # Drop the pending frame (if any) so the worker always sees the latest one
+        # (recv and on_ended run on different threads, so another put may land in between)
+        while True:
+            try:
+                self.frame_slot.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.frame_slot.put_nowait(job)
+                return
+            except queue.Full:
+                continue
+
+    def recv(self, frame):
+        if self.stopped.is_set():
+            return frame
+
+        self.count += 1
+        decode_frame = self.count % self.FRAME_SKIP == 0
+
+        with self.result_lock:
+            boxes = self.last_boxes
+
+        # Nothing to draw: hand back the original frame, no BGR conversion or re-wrap
+        if not boxes:
+            if decode_frame:
+                # The "gray" format is just the Y plane of the (usually YUV) frame, a third of BGR's bytes
+                self._submit(_shrink(frame.to_ndarray(format="gray")))
+            return frame
+
+        img = frame.to_ndarray(format="bgr24")
+
+        if decode_frame:
+            self._submit(_shrink(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)))
+
+        # Draw straight into the frame buffer; no per-frame result objects are built here
+        for pt1, pt2 in boxes:
+            cv2.rectangle(img, pt1, pt2, (0, 255, 0), 2)
+
+        return av.VideoFrame.from_ndarray(img, format="bgr24")
+
+    def on_ended(self):
+        # The flag stops the worker even if a late recv replaces the wake-up sentinel
+        self.stopped.set()
+        self._submit(None)